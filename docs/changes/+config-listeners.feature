@@ -0,0 +1,5 @@
+Add ``add_listener`` and ``remove_listener`` to gevent's configuration
+settings. Listeners are called with the new value, in the thread that
+set it, each time the setting changes. The periodic monitoring thread
+uses this to follow changes to ``max_blocking_time`` instead of reading
+it every time it wakes up.
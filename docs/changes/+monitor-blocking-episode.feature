@@ -0,0 +1,7 @@
+When the periodic monitoring thread finds the same greenlet still
+blocking the event loop, without having switched since the last check,
+it no longer formats and prints the whole report again. It prints one
+line saying how many times the block has been found and how long it
+has lasted. :class:`gevent.events.EventLoopBlocked` is still emitted
+each time, and its ``blocking_time`` is now the time since the block
+began rather than always ``max_blocking_time``.
@@ -0,0 +1,4 @@
+Monitoring functions stay on their cadence when the periodic
+monitoring thread wakes up late. The next run is counted from when
+each function was due, not from when it actually ran, unless it has
+fallen more than a whole period behind.
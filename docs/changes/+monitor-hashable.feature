@@ -0,0 +1,4 @@
+Functions passed to
+:meth:`gevent.events.IPeriodicMonitorThread.add_monitoring_function`
+must now be hashable. The periodic monitoring thread uses them as keys
+to find the entry to update or remove.
@@ -0,0 +1,3 @@
+When no monitoring functions are scheduled, the periodic monitoring
+thread waits until one is added (or it is killed) instead of waking
+up periodically to check.
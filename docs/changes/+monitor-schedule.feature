@@ -0,0 +1,3 @@
+The periodic monitoring thread now keeps its monitoring functions in a
+schedule ordered by when each is next due, and sleeps until the next
+one is due instead of for the shortest period of any of them.
@@ -16,6 +16,7 @@ import textwrap
 
 from gevent._compat import string_types
 from gevent._compat import WIN
+from gevent._compat import thread_mod_name
 
 __all__ = [
     'config',
@@ -23,6 +24,11 @@ __all__ = [
 
 ALL_SETTINGS = []
 
+# Guards changes to the listeners of every Setting. Monitoring threads
+# add and remove themselves from whichever native thread their hub
+# runs in.
+_listeners_lock = __import__(thread_mod_name).allocate_lock()
+
 class SettingType(type):
     # pylint:disable=bad-mcs-classmethod-argument
 
@@ -118,6 +124,10 @@ class Setting(object):
     default = None
     environment_key = None
     document = True
+    # Callables to notify when we are `set`. Replaced, not mutated,
+    # so that it's safe to iterate while listeners are being changed;
+    # changes are made holding _listeners_lock.
+    _listeners = ()
 
     desc = """\
 
@@ -148,6 +158,25 @@ class Setting(object):
 
     def set(self, val):
         self.value = self.validate(self._convert(val))
+        for listener in self._listeners:
+            listener(self.value)
+
+    def add_listener(self, listener):
+        """
+        Arrange for *listener* to be called with the new (validated)
+        value each time this setting is `set`.
+
+        Listeners are called in the thread that changed the setting.
+        """
+        with _listeners_lock:
+            self._listeners += (listener,)
+
+    def remove_listener(self, listener):
+        """
+        Stop calling *listener*. Does nothing if it wasn't added.
+        """
+        with _listeners_lock:
+            self._listeners = tuple(l for l in self._listeners if l != listener)
 
 
 Setting = SettingType('Setting', (Setting,), dict(Setting.__dict__))
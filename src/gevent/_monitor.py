@@ -4,6 +4,8 @@ from __future__ import print_function, absolute_import, division
 import os
 import sys
 
+from heapq import heappop
+from heapq import heappush
 from weakref import ref as wref
 
 from greenlet import getcurrent
@@ -21,6 +23,7 @@ from gevent._tracer import GreenletTracer
 from gevent._compat import thread_mod_name
 from gevent._compat import perf_counter
 from gevent._compat import get_this_psutil_process
+from gevent._util import gmctime
 
 
 
@@ -30,6 +33,12 @@ __all__ = [
 
 get_thread_ident = get_original(thread_mod_name, 'get_ident')
 start_new_thread = get_original(thread_mod_name, 'start_new_thread')
+allocate_lock = get_original(thread_mod_name, 'allocate_lock')
+thread_error = get_original(thread_mod_name, 'error')
+# This must be the real ``time.sleep``, never gevent's: we sleep in a
+# native thread, and only the builtin reliably releases the GIL for
+# the hub's thread to use while we wait. ``get_original`` gives us that
+# even if ``time`` has already been monkey-patched.
 thread_sleep = get_original('time', 'sleep')
 
 
@@ -40,12 +49,16 @@ class MonitorWarning(RuntimeWarning):
 
 class _MonitorEntry(object):
 
-    __slots__ = ('function', 'period', 'last_run_time')
+    __slots__ = ('function', 'period', 'last_run_time', 'next_deadline')
 
     def __init__(self, function, period):
         self.function = function
         self.period = period
         self.last_run_time = 0
+        # The perf_counter() value at which we are next due to run,
+        # or None if we have been removed. This must match the deadline
+        # of our entry in the schedule heap for that entry to be valid.
+        self.next_deadline = None
 
     def __eq__(self, other):
         return self.function == other.function and self.period == other.period
@@ -59,10 +72,6 @@ class PeriodicMonitoringThread(object):
     # This doesn't extend threading.Thread because that gets monkey-patched.
     # We use the low-level 'start_new_thread' primitive instead.
 
-    # The amount of seconds we will sleep when we think we have nothing
-    # to do.
-    inactive_sleep_time = 2.0
-
     # The absolute minimum we will sleep, regardless of
     # what particular monitoring functions want to say.
     min_sleep_time = 0.005
@@ -72,17 +81,44 @@ class PeriodicMonitoringThread(object):
     min_memory_monitor_period = 2
 
     # A list of _MonitorEntry objects: [(function(hub), period, last_run_time))]
-    # The first entry is always our entry for self.monitor_blocking
+    # The first entry is our entry for self.monitor_blocking, unless
+    # that has been removed.
     _monitoring_functions = None
 
-    # The calculated min sleep time for the monitoring functions list.
-    _calculated_sleep_time = None
+    # {function: _MonitorEntry}, for the same entries, so that adding,
+    # updating and removing don't have to search the list.
+    _monitoring_entries = None
+
+    # A heap of (next_deadline, id(entry), entry) tuples, one
+    # for each scheduled _MonitorEntry. Entries are not removed
+    # eagerly: when an entry is removed or rescheduled, the tuple
+    # in the heap becomes stale (its deadline no longer matches the
+    # entry) and is discarded when it is popped.
+    _schedule_heap = None
+
+    # A native lock protecting _schedule_heap and the next_deadline of
+    # its entries. The monitoring thread pops from the heap, while
+    # other threads (adding functions, changing the configuration)
+    # push onto it.
+    _schedule_lock = None
+
+    # A native lock that is held except when we have been asked to
+    # wake up. When nothing is scheduled, the monitoring thread blocks
+    # acquiring it instead of waking up every so often to check.
+    _wake_lock = None
 
     # A boolean value that also happens to capture the
     # memory usage at the time we exceeded the threshold. Reset
     # to 0 when we go back below.
     _memory_exceeded = 0
 
+    # The (greenlet, report, started, count) we returned from
+    # monitor_blocking for the block that is still going on, if any:
+    # *started* is our estimate of when it began, and *count* how many
+    # times we've found it. Reset to None as soon as the loop switches
+    # again.
+    _reported_block = None
+
     # The instance of GreenletTracer we're using
     _greenlet_tracer = None
 
@@ -95,9 +131,19 @@ class PeriodicMonitoringThread(object):
         assert get_thread_ident() == hub.thread_ident
         self._greenlet_tracer = GreenletTracer()
 
-        self._monitoring_functions = [_MonitorEntry(self.monitor_blocking,
-                                                    GEVENT_CONFIG.max_blocking_time)]
-        self._calculated_sleep_time = GEVENT_CONFIG.max_blocking_time
+        entry = _MonitorEntry(self.monitor_blocking,
+                              GEVENT_CONFIG.max_blocking_time)
+        self._monitoring_functions = [entry]
+        self._monitoring_entries = {entry.function: entry}
+        self._schedule_heap = []
+        self._schedule_lock = allocate_lock()
+        self._wake_lock = allocate_lock()
+        self._wake_lock.acquire()
+        self._reschedule(entry, perf_counter())
+        # Rather than checking the configuration each time we wake up,
+        # get told when it changes.
+        GEVENT_CONFIG.settings['max_blocking_time'].add_listener(
+            self._on_max_blocking_time_changed)
         # Create the actual monitoring thread. This is effectively a "daemon"
         # thread.
         self.monitor_thread_ident = start_new_thread(self, ())
@@ -108,10 +154,19 @@ class PeriodicMonitoringThread(object):
     def _on_fork(self):
         # Pseudo-standard method that resolver_ares and threadpool
         # also have, called by hub.reinit()
+        # Our thread didn't survive the fork; start a new one, unless
+        # we had already been killed, in which case it would just exit.
         pid = os.getpid()
         if pid != self.pid:
             self.pid = pid
-            self.monitor_thread_ident = start_new_thread(self, ())
+            # Our thread may have been holding one of our locks when we
+            # forked; nothing in this process would ever release it.
+            # The new thread looks the locks up when it starts.
+            self._schedule_lock = allocate_lock()
+            self._wake_lock = allocate_lock()
+            self._wake_lock.acquire()
+            if self.should_run:
+                self.monitor_thread_ident = start_new_thread(self, ())
 
     @property
     def hub(self):
@@ -120,45 +175,104 @@ class PeriodicMonitoringThread(object):
 
     def monitoring_functions(self):
         # Return a list of _MonitorEntry objects
-
-        # Update max_blocking_time each time.
-        mbt = GEVENT_CONFIG.max_blocking_time # XXX: Events so we know when this changes.
-        if mbt != self._monitoring_functions[0].period:
-            self._monitoring_functions[0].period = mbt
-            self._calculated_sleep_time = min(x.period for x in self._monitoring_functions)
         return self._monitoring_functions
 
+    def _on_max_blocking_time_changed(self, mbt):
+        # Called by GEVENT_CONFIG, in whatever thread changed it.
+        entry = self._monitoring_entries.get(self.monitor_blocking)
+        if entry is None:
+            # Removed; nothing to update.
+            return
+        with self._schedule_lock:
+            # The monitoring thread reads the period holding this lock.
+            if mbt == entry.period:
+                return
+            entry.period = mbt
+            self._reschedule_locked(entry, perf_counter())
+        self._wake()
+
     def add_monitoring_function(self, function, period):
         if not callable(function):
             raise ValueError("function must be callable")
 
+        entries = self._monitoring_entries
         if period is None:
-            # Remove.
-            self._monitoring_functions = [
-                x for x in self._monitoring_functions
-                if x.function != function
-            ]
+            # Remove. Any tuple for it still on the heap is now stale.
+            entry = entries.pop(function, None)
+            if entry is not None:
+                self._schedule(entry, None)
+                self._monitoring_functions = [
+                    x for x in self._monitoring_functions
+                    if x is not entry
+                ]
         elif period <= 0:
             raise ValueError("Period must be positive.")
         else:
             # Add or update period
-            entry = _MonitorEntry(function, period)
-            self._monitoring_functions = [
-                x if x.function != function else entry
-                for x in self._monitoring_functions
-            ]
-            if entry not in self._monitoring_functions:
-                self._monitoring_functions.append(entry)
-        self._calculated_sleep_time = min(x.period for x in self._monitoring_functions)
+            entry = entries.get(function)
+            if entry is None:
+                entry = entries[function] = _MonitorEntry(function, period)
+                self._monitoring_functions = self._monitoring_functions + [entry]
+            with self._schedule_lock:
+                entry.period = period
+                # Run when we next wake up anyway, but no later than one
+                # period from now.
+                deadline = perf_counter() + period
+                heap = self._schedule_heap
+                if heap and heap[0][0] < deadline:
+                    deadline = heap[0][0]
+                self._schedule_locked(entry, deadline)
+            self._wake()
+
+    def _wake(self):
+        # Let the monitoring thread know the schedule changed, in case
+        # it's blocked because there was nothing on it.
+        try:
+            self._wake_lock.release()
+        except thread_error:
+            # Already woken, and it hasn't noticed yet.
+            pass
+
+    def _schedule(self, entry, deadline):
+        # Put *entry* on the heap, due at *deadline*, or take it off
+        # the schedule if *deadline* is None.
+        with self._schedule_lock:
+            self._schedule_locked(entry, deadline)
+
+    def _schedule_locked(self, entry, deadline):
+        # As for _schedule, but the caller holds _schedule_lock.
+        entry.next_deadline = deadline
+        if deadline is not None:
+            heappush(self._schedule_heap, (deadline, id(entry), entry))
+
+    def _reschedule(self, entry, now):
+        # Put *entry* on the heap, due one period after *now*.
+        with self._schedule_lock:
+            self._reschedule_locked(entry, now)
+
+    def _reschedule_locked(self, entry, now):
+        # As for _reschedule, but the caller holds _schedule_lock.
+        # An entry that is disabled (doesn't have a positive period)
+        # isn't scheduled at all; enabling it schedules it again.
+        period = entry.period
+        if not period or period <= 0:
+            self._schedule_locked(entry, None)
+        else:
+            self._schedule_locked(entry, now + period)
 
     def calculate_sleep_time(self):
-        min_sleep = self._calculated_sleep_time
-        if min_sleep <= 0:
-            # Everyone wants to be disabled. Sleep for a longer period of
-            # time than usual so we don't spin unnecessarily. We might be
-            # enabled again in the future.
-            return self.inactive_sleep_time
-        return max((min_sleep, self.min_sleep_time))
+        heap = self._schedule_heap
+        with self._schedule_lock:
+            # Discard stale entries so we don't wake up for nothing.
+            while heap and heap[0][2].next_deadline != heap[0][0]:
+                heappop(heap)
+            if not heap:
+                # Everyone has been removed or disabled. Return None: rather
+                # than waking up periodically to check, we wait to be told
+                # we have something to do again.
+                return None
+            next_deadline = heap[0][0]
+        return max(self.min_sleep_time, next_deadline - perf_counter())
 
     def kill(self):
         if not self.should_run:
@@ -166,6 +280,10 @@ class PeriodicMonitoringThread(object):
             return
         # Stop this monitoring thread from running.
         self.should_run = False
+        self._reported_block = None
+        self._wake()
+        GEVENT_CONFIG.settings['max_blocking_time'].remove_listener(
+            self._on_max_blocking_time_changed)
         # Uninstall our tracing hook
         self._greenlet_tracer.kill()
 
@@ -178,30 +296,84 @@ class PeriodicMonitoringThread(object):
         # create an immortal DummyThread object.
         getcurrent().gevent_monitoring_thread = wref(self)
 
+        # Look these up once; the loop runs for the life of the hub.
+        # (should_run, though, must be checked each time: kill() can be
+        # called from any thread.)
+        sleep = thread_sleep
+        wait_for_wake = self._wake_lock.acquire
+        now = perf_counter
+        calculate_sleep_time = self.calculate_sleep_time
+        reschedule = self._reschedule_locked
+        schedule_lock = self._schedule_lock
+        hub_wref = self._hub_wref
+        heap = self._schedule_heap
+        min_sleep_time = self.min_sleep_time
+
         try:
             while self.should_run:
-                functions = self.monitoring_functions()
-                assert functions
-                sleep_time = self.calculate_sleep_time()
-
-                thread_sleep(sleep_time)
+                sleep_time = calculate_sleep_time()
+                if sleep_time is None:
+                    wait_for_wake()
+                else:
+                    sleep(sleep_time)
 
                 # Make sure the hub is still around, and still active,
                 # and keep it around while we are here.
-                hub = self.hub
+                hub = hub_wref()
                 if not hub:
                     self.kill()
 
                 if self.should_run:
-                    this_run = perf_counter()
-                    for entry in functions:
-                        f = entry.function
-                        period = entry.period
-                        last_run = entry.last_run_time
-                        if period and last_run + period <= this_run:
+                    this_run = now()
+                    # Anything due within min_sleep_time of now runs
+                    # during this wake-up: we wouldn't sleep for less than
+                    # that to wait for it anyway, and this way entries with
+                    # nearly identical deadlines cost one wake-up, not two.
+                    horizon = this_run + min_sleep_time
+                    with schedule_lock:
+                        # Take everything that's due off the heap before
+                        # putting any of it back, so that each entry runs
+                        # at most once per wake-up, however short its
+                        # period.
+                        due = []
+                        while heap and heap[0][0] <= horizon:
+                            deadline, _, entry = heappop(heap)
+                            if entry.next_deadline == deadline:
+                                due.append((deadline, entry))
+                            # Otherwise, it was removed or rescheduled since
+                            # this was pushed.
+                        for deadline, entry in due:
+                            # Reschedule first, so that we're still on the
+                            # heap if the function raises. Count from when we
+                            # were due, not from now: the OS routinely wakes
+                            # us a bit late, and that shouldn't accumulate
+                            # into drift. But if we've fallen more than a
+                            # whole period behind, don't try to catch up.
+                            period = entry.period
+                            if period and deadline + period > this_run:
+                                reschedule(entry, deadline)
+                            else:
+                                reschedule(entry, this_run)
+                    # Call them without holding the lock: they may well
+                    # want to add or remove monitoring functions.
+                    for _, entry in due:
+                        if entry.next_deadline is None:
+                            # Removed by one of the others.
+                            continue
+                        if entry.period:
                             entry.last_run_time = this_run
-                            f(hub)
-                del hub # break our reference to hub while we sleep
+                            try:
+                                entry.function(hub)
+                            except Exception: # pylint:disable=broad-except
+                                # One broken monitoring function shouldn't
+                                # stop the others, or this thread. Report it
+                                # and carry on. (Not with hub.handle_error:
+                                # that wants to switch to the hub, which is
+                                # running in another thread.)
+                                hub.print_exception(entry.function, *sys.exc_info())
+                # Rebind rather than del: break our reference to hub while
+                # we sleep.
+                hub = None
 
         except SystemExit:
             pass
@@ -228,9 +400,27 @@ class PeriodicMonitoringThread(object):
 
         did_block = self._greenlet_tracer.did_block_hub(hub)
         if not did_block:
+            self._reported_block = None
             return
 
         active_greenlet = did_block[1]
+        now = perf_counter()
+        reported_block = self._reported_block
+        if reported_block is not None and reported_block[0] is active_greenlet:
+            # Still the same block we already reported (there have
+            # been no switches since). Don't spend time formatting the
+            # same report, or flood the stream with it, every period;
+            # just say how long it's been going on.
+            _, report, started, count = reported_block
+            count += 1
+            blocking_time = now - started
+            line = '%s : Greenlet %s still blocked (found %d times, %.2f seconds)' % (
+                gmctime(), str(active_greenlet), count, blocking_time)
+            print(line, file=hub.exception_stream)
+            notify(EventLoopBlocked(active_greenlet, blocking_time, report + [line]))
+            self._reported_block = (active_greenlet, report, started, count)
+            return self._reported_block
+
         report = self._greenlet_tracer.did_block_hub_report(
             hub, active_greenlet,
             dict(greenlet_stacks=False, current_thread_ident=self.monitor_thread_ident))
@@ -242,13 +432,19 @@ class PeriodicMonitoringThread(object):
             # when the report is large.
             print(line, file=stream)
 
-        notify(EventLoopBlocked(active_greenlet, GEVENT_CONFIG.max_blocking_time, report))
-        return (active_greenlet, report)
+        # It hasn't switched for at least as long as we've been
+        # waiting to check.
+        blocking_time = GEVENT_CONFIG.max_blocking_time
+        notify(EventLoopBlocked(active_greenlet, blocking_time, report))
+        self._reported_block = (active_greenlet, report, now - blocking_time, 1)
+        return self._reported_block
 
     def ignore_current_greenlet_blocking(self):
+        self._reported_block = None
         self._greenlet_tracer.ignore_current_greenlet_blocking()
 
     def monitor_current_greenlet_blocking(self):
+        self._reported_block = None
         self._greenlet_tracer.monitor_current_greenlet_blocking()
 
     def _get_process(self): # pylint:disable=method-hidden
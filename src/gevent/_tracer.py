@@ -56,14 +56,14 @@ class GreenletTracer(object):
     def _trace(self, event, args):
         # This function runs in the thread we are monitoring.
         self.greenlet_switch_counter += 1
-        if event in ('switch', 'throw'):
-            # args is (origin, target). This is the only defined
-            # case
-            self.active_greenlet = args[1]
-        else:
-            self.active_greenlet = None
-        if self.previous_trace_function is not None:
-            self.previous_trace_function(event, args)
+        # args is (origin, target) for these events. They are the only
+        # defined cases. Leave this as a literal tuple: Cython turns it
+        # into inline string comparisons, which beats any container
+        # lookup.
+        self.active_greenlet = args[1] if event in ('switch', 'throw') else None
+        previous_trace_function = self.previous_trace_function
+        if previous_trace_function is not None:
+            previous_trace_function(event, args)
 
     def __call__(self, event, args):
         return self._trace(event, args)
@@ -119,6 +119,13 @@ class IPeriodicMonitorThread(Interface):
         in the monitoring thread, *not* the hub thread. It **must not** attempt to
         use the gevent asynchronous API.
 
+        The *function* must be hashable; it is used as a key to find
+        the entry when it is updated or removed.
+
+        If the *function* raises an exception, it is printed to the
+        hub's ``exception_stream`` and the function keeps being called
+        on schedule.
+
         If the *function* is already a monitoring function, then its *period*
         will be updated for future runs.
 
@@ -119,6 +119,56 @@ class TestConfig(unittest.TestCase):
         with self.assertRaises(AttributeError):
             _config.config.set('no such setting', True)
 
+class TestSettingListeners(unittest.TestCase):
+
+    def test_listeners(self):
+        conf = _config.Config()
+        setting = conf.settings['max_blocking_time']
+        changes = []
+        setting.add_listener(changes.append)
+
+        conf.max_blocking_time = '0.5'
+        self.assertEqual([0.5], changes)
+
+        setting.remove_listener(changes.append)
+        conf.max_blocking_time = 1
+        self.assertEqual([0.5], changes)
+        # Removing again is harmless
+        setting.remove_listener(changes.append)
+
+    def test_listeners_changed_from_many_threads(self):
+        import threading
+        setting = _config.Config().settings['max_blocking_time']
+        def churn():
+            listener = lambda _v: None
+            for _ in range(1000):
+                setting.add_listener(listener)
+                setting.remove_listener(listener)
+            setting.add_listener(listener)
+
+        threads = [threading.Thread(target=churn) for _ in range(8)]
+        # Switch threads as often as we can, to give them every chance
+        # to interleave. (Python 2 has no switch interval.)
+        interval = getattr(sys, 'getswitchinterval', lambda: None)()
+        if interval is not None:
+            sys.setswitchinterval(1e-6)
+        try:
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        finally:
+            if interval is not None:
+                sys.setswitchinterval(interval)
+        # No add or remove was lost.
+        self.assertEqual(8, len(setting._listeners))
+
+    def test_listeners_not_shared(self):
+        conf = _config.Config()
+        conf.settings['max_blocking_time'].add_listener(self.fail)
+        _config.Config().max_blocking_time = 1
+
+
 class TestImportableSetting(unittest.TestCase):
 
     assertRaisesRegex = getattr(unittest.TestCase, 'assertRaisesRegex',
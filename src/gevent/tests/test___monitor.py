@@ -36,6 +36,9 @@ class MockHub(object):
     def handle_error(self, *args): # pylint:disable=unused-argument
         raise # pylint:disable=misplaced-bare-raise
 
+    def print_exception(self, context, t, v, tb): # pylint:disable=unused-argument
+        self.exception_stream.write('%s failed with %s\n' % (context, t.__name__))
+
     @property
     def loop(self):
         return self
@@ -83,6 +86,16 @@ class TestPeriodicMonitoringThread(_AbstractTestPeriodicMonitoringThread,
         self.assertEqual(0xDEADBEEF, self.pmt.monitor_thread_ident)
         self.assertEqual(gettrace(), self.pmt._greenlet_tracer)
 
+    def test_thread_sleep_is_builtin(self):
+        import time
+        import types
+        from gevent import monkey
+        sleep = self._orig_thread_sleep
+        self.assertIsInstance(sleep, types.BuiltinFunctionType)
+        self.assertIs(sleep, get_original('time', 'sleep'))
+        if not monkey.is_module_patched('time'):
+            self.assertIs(sleep, time.sleep)
+
     @skipWithoutPSUtil("Verifies the process")
     def test_get_process(self):
         proc = self.pmt._get_process()
@@ -123,31 +136,154 @@ class TestPeriodicMonitoringThread(_AbstractTestPeriodicMonitoringThread,
         # Remove
         self.pmt.add_monitoring_function(f, None)
         self.assertEqual(self.len_pmt_default_funcs, len(self.pmt.monitoring_functions()))
+        # Removing something that isn't there is harmless.
+        self.pmt.add_monitoring_function(f, None)
+        self.assertEqual(self.len_pmt_default_funcs, len(self.pmt.monitoring_functions()))
 
     def test_calculate_sleep_time(self):
-        self.assertEqual(
-            self.pmt.monitoring_functions()[0].period,
-            self.pmt.calculate_sleep_time())
-
-        # Pretend that GEVENT_CONFIG.max_blocking_time was set to 0,
-        # to disable this monitor.
-        self.pmt._calculated_sleep_time = 0
-        self.assertEqual(
-            self.pmt.inactive_sleep_time,
-            self.pmt.calculate_sleep_time()
-        )
-
-        # Getting the list of monitoring functions will also
-        # do this, if it looks like it has changed
-        self.pmt.monitoring_functions()[0].period = -1
-        self.pmt._calculated_sleep_time = 0
-        self.pmt.monitoring_functions()
-        self.assertEqual(
-            self.pmt.monitoring_functions()[0].period,
-            self.pmt.calculate_sleep_time())
-        self.assertEqual(
-            self.pmt.monitoring_functions()[0].period,
-            self.pmt._calculated_sleep_time)
+        # We sleep until the next function is due.
+        period = self.pmt.monitoring_functions()[0].period
+        sleep_time = self.pmt.calculate_sleep_time()
+        self.assertLessEqual(sleep_time, period)
+        self.assertGreater(sleep_time, period / 2)
+
+        # But never less than the minimum.
+        entry = self.pmt.monitoring_functions()[0]
+        entry.period = 0.0001
+        self.pmt._reschedule(entry, monitor.perf_counter())
+        self.assertEqual(self.pmt.min_sleep_time, self.pmt.calculate_sleep_time())
+
+        # Changing GEVENT_CONFIG.max_blocking_time reschedules.
+        try:
+            GEVENT_CONFIG.max_blocking_time = 0.5
+            self.assertEqual(0.5, entry.period)
+            self.assertGreater(self.pmt.calculate_sleep_time(), 0.4)
+
+            # Setting it to 0 disables it; with nothing else to do,
+            # we don't need to wake up at all.
+            GEVENT_CONFIG.max_blocking_time = 0
+            self.assertIsNone(entry.period)
+            self.assertIsNone(self.pmt.calculate_sleep_time())
+        finally:
+            GEVENT_CONFIG.max_blocking_time = period
+        self.assertEqual(period, entry.period)
+        self.assertIsNotNone(self.pmt.calculate_sleep_time())
+
+        # Once killed, we stop listening for changes.
+        self.pmt.kill()
+        try:
+            GEVENT_CONFIG.max_blocking_time = 0.5
+            self.assertEqual(period, entry.period)
+        finally:
+            GEVENT_CONFIG.max_blocking_time = period
+
+    def test_calculate_sleep_time_nothing_scheduled(self):
+        # If everything is removed, we sleep until woken.
+        self.pmt.add_monitoring_function(self.pmt.monitor_blocking, None)
+        self.assertIsNone(self.pmt.calculate_sleep_time())
+
+    def test_max_blocking_time_changed_after_removing_monitor_blocking(self):
+        period = GEVENT_CONFIG.max_blocking_time
+        self.pmt.add_monitoring_function(self.pmt.monitor_blocking, None)
+        try:
+            # Nothing left to update...
+            GEVENT_CONFIG.max_blocking_time = 0.5
+            self.assertEqual([], self.pmt.monitoring_functions())
+
+            # ...and the change doesn't go to whatever is first now.
+            def f(_hub):
+                "Does nothing"
+            self.pmt.add_monitoring_function(f, 5)
+            GEVENT_CONFIG.max_blocking_time = 0.25
+            self.assertEqual(5, self.pmt.monitoring_functions()[0].period)
+        finally:
+            GEVENT_CONFIG.max_blocking_time = period
+
+    def test_call_nothing_scheduled_waits_until_woken(self):
+        import threading
+        self.pmt.add_monitoring_function(self.pmt.monitor_blocking, None)
+        done = threading.Event()
+        def run():
+            self.pmt()
+            done.set()
+        thread = threading.Thread(target=run)
+        thread.start()
+        # With nothing to do, it waits...
+        self.assertFalse(done.wait(0.1))
+        # ...until something changes.
+        self.pmt.kill()
+        self.assertTrue(done.wait(5))
+        thread.join()
+
+    def test_call_runs_due_functions_in_deadline_order(self):
+        called = []
+        def f(_hub):
+            called.append('f')
+        def g(_hub):
+            called.append('g')
+            self.pmt.kill()
+
+        self.pmt.add_monitoring_function(g, 1)
+        self.pmt.add_monitoring_function(f, 1)
+        g_entry, f_entry = self.pmt.monitoring_functions()[-2:]
+        now = monitor.perf_counter()
+        self.pmt._schedule(g_entry, now - 1)
+        self.pmt._schedule(f_entry, now - 2)
+        self.pmt()
+        self.assertEqual(['f', 'g'], called)
+        self.assertFalse(self.pmt.should_run)
+
+    def test_call_coalesces_nearby_deadlines(self):
+        called = []
+        def f(_hub):
+            called.append('f')
+            self.pmt.kill()
+        def g(_hub):
+            called.append('g')
+
+        self.pmt.add_monitoring_function(f, 1)
+        self.pmt.add_monitoring_function(g, 1)
+        f_entry, g_entry = self.pmt.monitoring_functions()[-2:]
+        now = monitor.perf_counter()
+        self.pmt._schedule(f_entry, now)
+        # Not quite due yet, but close enough that it runs in the same
+        # wake-up as f.
+        self.pmt._schedule(g_entry, now + self.pmt.min_sleep_time / 2)
+        self.pmt()
+        self.assertEqual(['f', 'g'], called)
+
+    def test_call_runs_short_period_once_per_wakeup(self):
+        # A period shorter than min_sleep_time would be due again
+        # before the end of the wake-up; it waits for the next one.
+        wakeups = []
+        monitor.thread_sleep = wakeups.append
+        called = []
+        def f(_hub):
+            called.append(len(wakeups))
+            if len(called) == 3:
+                self.pmt.kill()
+
+        self.pmt.add_monitoring_function(f, self.pmt.min_sleep_time / 5)
+        self.pmt()
+        self.assertEqual([1, 2, 3], called)
+
+    def test_call_reschedules_from_deadline(self):
+        def f(_hub):
+            self.pmt.kill()
+        def g(_hub):
+            pass
+
+        self.pmt.add_monitoring_function(f, 1)
+        self.pmt.add_monitoring_function(g, 1)
+        f_entry, g_entry = self.pmt.monitoring_functions()[-2:]
+        now = monitor.perf_counter()
+        # A little late: we keep to the original cadence.
+        self.pmt._schedule(f_entry, now - 0.5)
+        # More than a period late: we start over from now.
+        self.pmt._schedule(g_entry, now - 5)
+        self.pmt()
+        self.assertAlmostEqual(now + 0.5, f_entry.next_deadline)
+        self.assertGreater(g_entry.next_deadline, now + 1)
 
     def test_call_destroyed_hub(self):
         # Add a function that destroys the hub so we break out (eventually)
@@ -179,15 +315,24 @@ class TestPeriodicMonitoringThread(_AbstractTestPeriodicMonitoringThread,
         self.pmt()
 
     def test_call_other_error(self):
+        # Reported, and the other functions still run.
         class MyException(Exception):
             pass
 
         def f(_hub):
             raise MyException()
+        def g(_hub):
+            self.pmt.kill()
 
         self.pmt.add_monitoring_function(f, 0.1)
-        with self.assertRaises(MyException):
-            self.pmt()
+        self.pmt.add_monitoring_function(g, 0.1)
+        f_entry, g_entry = self.pmt.monitoring_functions()[-2:]
+        now = monitor.perf_counter()
+        self.pmt._schedule(f_entry, now - 2)
+        self.pmt._schedule(g_entry, now - 1)
+        self.pmt()
+        self.assertIn('failed with MyException',
+                      self.hub.exception_stream.getvalue())
 
     def test_hub_reinit(self):
         import os
@@ -200,6 +345,36 @@ class TestPeriodicMonitoringThread(_AbstractTestPeriodicMonitoringThread,
         self.assertEqual(os.getpid(), self.pmt.pid)
         self.assertEqual(old_tid + 1, self.pmt.monitor_thread_ident)
 
+    def test_hub_reinit_with_lock_held(self):
+        from gevent.hub import reinit
+        self.pmt.pid = -1
+        # As if the monitoring thread had been holding it when we
+        # forked.
+        self.pmt._schedule_lock.acquire()
+
+        reinit(self.hub)
+
+        # The wake lock is held, waiting to be released...
+        self.assertFalse(self.pmt._wake_lock.acquire(False))
+        # ...and we can still schedule things.
+        def f(_hub):
+            "Does nothing"
+        self.pmt.add_monitoring_function(f, 1)
+        self.assertIsNotNone(self.pmt.calculate_sleep_time())
+
+    def test_hub_reinit_after_kill(self):
+        import os
+        from gevent.hub import reinit
+        self.pmt.pid = -1
+        old_tid = self.pmt.monitor_thread_ident
+        self.pmt.kill()
+
+        reinit(self.hub)
+
+        self.assertEqual(os.getpid(), self.pmt.pid)
+        # No new thread was started.
+        self.assertEqual(old_tid, self.pmt.monitor_thread_ident)
+
 
 
 class TestPeriodicMonitorBlocking(_AbstractTestPeriodicMonitoringThread,
@@ -275,10 +450,35 @@ class TestPeriodicMonitorBlocking(_AbstractTestPeriodicMonitoringThread,
         # And back again
         self.pmt.monitor_current_greenlet_blocking()
         self.assertTrue(self.pmt.monitor_blocking(self.hub))
+        self.assertTrue(events)
+        info = events[0].info
+        del events[:]
+
+        # While that same block goes on, we don't print it again, just
+        # a line saying how long it's been; subscribers hear about it
+        # too.
+        report = self.hub.exception_stream.getvalue()
+        started = self.pmt._reported_block[2]
+        for count in 2, 3:
+            result = self.pmt.monitor_blocking(self.hub)
+            self.assertEqual(count, result[3])
+            self.assertEqual(1, len(events))
+            event = events.pop()
+            self.assertEqual(info, event.info[:-1])
+            self.assertIn('still blocked (found %d times' % count, event.info[-1])
+            # Counted from when it started, not just one period.
+            self.assertGreater(event.blocking_time, GEVENT_CONFIG.max_blocking_time)
+            self.assertLessEqual(event.blocking_time, monitor.perf_counter() - started)
+        printed = self.hub.exception_stream.getvalue()[len(report):]
+        self.assertEqual(2, len(printed.splitlines()))
+        self.assertIn('still blocked (found 3 times', printed)
 
         # A bad thread_ident in the hub doesn't mess things up
+        self.pmt._greenlet_tracer('switch', (target, origin))
+        self.assertFalse(self.pmt.monitor_blocking(self.hub))
         self.hub.thread_ident = -1
         self.assertTrue(self.pmt.monitor_blocking(self.hub))
+        self.assertTrue(events)
 
 
 class MockProcess(object):
@@ -245,12 +245,18 @@ class TestPeriodicMonitoringThread(greentest.TestCase):
         threadpool = hub.threadpool
 
         worker_hub = threadpool.apply(get_hub)
+        # apply() returns as soon as the result is set, which may be
+        # before the worker thread marks the task as done; if we
+        # spawned again before then, the pool would grow and the next
+        # task could run in a different thread with a different hub.
+        threadpool.join()
         stream = worker_hub.exception_stream = NativeStrIO()
 
         # It does not have a monitoring thread yet
         self.assertIsNone(worker_hub.periodic_monitoring_thread)
         # So switch to it and give it one.
         threadpool.apply(gevent.sleep, (0.01,))
+        threadpool.join()
         self.assertIsNotNone(worker_hub.periodic_monitoring_thread)
         worker_monitor = worker_hub.periodic_monitoring_thread
         worker_monitor.add_monitoring_function(self._monitor, 0.1)